@@ -0,0 +1,250 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, jsonify, request
+
+from logging_config import HOT_PATH
+
+logger = logging.getLogger(__name__)
+
+# Limiti predefiniti per endpoint:
+# - client_rate/client_burst: token bucket per singolo client (richieste/secondo, picco)
+# - route_rate/route_burst: token bucket complessivo della rotta
+# - concurrency: richieste contemporanee ammesse per processo
+DEFAULT_LIMITS = {
+    'api_calcola_codice_fiscale': {
+        'client_rate': 5, 'client_burst': 20,
+        'route_rate': 50, 'route_burst': 100,
+    },
+    'api_calcola_scadenza': {
+        'client_rate': 5, 'client_burst': 20,
+        'route_rate': 50, 'route_burst': 100,
+    },
+    'export_guests': {
+        'client_rate': 0.1, 'client_burst': 3,
+        'route_rate': 1, 'route_burst': 5,
+        'concurrency': 2,
+    },
+}
+
+# Secondi suggeriti al client quando non ci sono slot di concorrenza liberi
+CONCURRENCY_RETRY_AFTER = 2
+
+# Oltre questo numero di bucket in memoria si eliminano quelli di nuovo pieni
+MAX_MEMORY_BUCKETS = 10000
+
+
+class MemoryBackend:
+    """Token bucket in memoria, condivisi tra i thread dello stesso processo"""
+
+    def __init__(self, max_buckets=MAX_MEMORY_BUCKETS):
+        # key -> (token, ultimo aggiornamento, istante in cui il bucket torna pieno)
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.max_buckets = max_buckets
+
+    def _prune(self, now):
+        """Elimina i bucket tornati pieni: equivalgono a un bucket mai usato"""
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items() if bucket[2] > now
+        }
+
+    def consume(self, key, rate, burst):
+        """
+        Preleva un token dal bucket indicato
+
+        Returns:
+            0 se la richiesta è ammessa, altrimenti i secondi di attesa suggeriti
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            retry_after = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if len(self._buckets) > self.max_buckets:
+                self._prune(now)
+            return retry_after
+
+
+class RedisBackend:
+    """Token bucket condivisi tra i worker tramite Redis (o un sostituto compatibile)"""
+
+    SCRIPT = """
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(data[1]) or burst
+local ts = tonumber(data[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local retry = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(retry)
+"""
+
+    def __init__(self, client, prefix='admission:'):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(self.SCRIPT)
+
+    @classmethod
+    def from_url(cls, url):
+        """Crea il backend a partire da un URL Redis (richiede il pacchetto redis)"""
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def consume(self, key, rate, burst):
+        """Come MemoryBackend.consume, ma in modo atomico sul server Redis"""
+        retry = self._script(keys=[self.prefix + key], args=[rate, burst, time.time()])
+        return float(retry)
+
+
+class AdmissionController:
+    """
+    Controllo di ammissione in-process per le rotte più costose
+
+    Le richieste oltre il limite ricevono subito un 429 (token bucket esaurito)
+    o un 503 (nessuno slot di concorrenza libero), con l'header Retry-After.
+    """
+
+    def __init__(self, limits=None, backend=None):
+        self.limits = limits if limits is not None else DEFAULT_LIMITS
+        self.backend = backend or MemoryBackend()
+        self._semaphores = {
+            endpoint: threading.BoundedSemaphore(limit['concurrency'])
+            for endpoint, limit in self.limits.items()
+            if limit.get('concurrency')
+        }
+        self._stats = defaultdict(lambda: defaultdict(int))
+        self._stats_lock = threading.Lock()
+
+    def _count(self, endpoint, counter, delta=1):
+        with self._stats_lock:
+            self._stats[endpoint][counter] += delta
+
+    def stats(self):
+        """Restituisce una copia dei contatori per endpoint"""
+        with self._stats_lock:
+            return {endpoint: dict(counters) for endpoint, counters in self._stats.items()}
+
+    def _reject(self, endpoint, status, retry_after, message):
+        self._count(endpoint, 'rejected_rate' if status == 429 else 'rejected_concurrency')
+        logger.warning("Richiesta respinta (%s) su %s", status, endpoint, extra=HOT_PATH)
+        response = jsonify({'error': message})
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def before_request(self):
+        endpoint = request.endpoint
+        limit = self.limits.get(endpoint)
+        if limit is None:
+            return None
+
+        try:
+            if 'client_rate' in limit:
+                client = request.remote_addr or 'anonimo'
+                retry_after = self.backend.consume(
+                    f'{endpoint}:{client}', limit['client_rate'], limit['client_burst'])
+                if retry_after:
+                    return self._reject(endpoint, 429, retry_after, 'Troppe richieste, riprovare più tardi')
+
+            if 'route_rate' in limit:
+                retry_after = self.backend.consume(
+                    endpoint, limit['route_rate'], limit['route_burst'])
+                if retry_after:
+                    return self._reject(endpoint, 429, retry_after, 'Troppe richieste, riprovare più tardi')
+        except Exception as e:
+            # Un backend condiviso non raggiungibile non deve bloccare il registro
+            logger.error("Errore nel backend di ammissione: %s", e)
+            self._count(endpoint, 'backend_errors')
+
+        semaphore = self._semaphores.get(endpoint)
+        if semaphore is not None:
+            if not semaphore.acquire(blocking=False):
+                return self._reject(endpoint, 503, CONCURRENCY_RETRY_AFTER, 'Servizio occupato, riprovare più tardi')
+            g.admission_semaphore = semaphore
+            self._count(endpoint, 'in_flight')
+
+        self._count(endpoint, 'admitted')
+        return None
+
+    def teardown_request(self, exc):
+        semaphore = g.pop('admission_semaphore', None)
+        if semaphore is not None:
+            semaphore.release()
+            self._count(request.endpoint, 'in_flight', -1)
+
+
+def load_limits(value=None):
+    """
+    Restituisce i limiti di ammissione, con le eventuali sostituzioni in JSON
+
+    Args:
+        value: JSON {endpoint: {parametro: valore}}; di default ADMISSION_LIMITS
+
+    I parametri indicati sostituiscono quelli predefiniti dell'endpoint; un
+    endpoint impostato a null viene escluso dal controllo.
+    """
+    if value is None:
+        value = os.environ.get('ADMISSION_LIMITS')
+    limits = {endpoint: dict(limit) for endpoint, limit in DEFAULT_LIMITS.items()}
+    if not value:
+        return limits
+
+    for endpoint, override in json.loads(value).items():
+        if override is None:
+            limits.pop(endpoint, None)
+        else:
+            limits.setdefault(endpoint, {}).update(override)
+    return limits
+
+
+def init_admission(app):
+    """
+    Registra il controllo di ammissione sull'applicazione
+
+    - ADMISSION_ENABLED: "0" per disattivarlo (default attivo)
+    - ADMISSION_REDIS_URL: URL Redis per condividere i token bucket tra i worker
+    - ADMISSION_LIMITS: JSON con i limiti che sostituiscono quelli predefiniti,
+      es. {"export_guests": {"concurrency": 1}}
+
+    Il bucket per client è associato a request.remote_addr: dietro un reverse
+    proxy va impostato PROXY_FIX_X_FOR (vedi app.py, default 0), altrimenti
+    tutti gli operatori condividono il bucket dell'indirizzo del proxy.
+    """
+    if os.environ.get('ADMISSION_ENABLED', '1') == '0':
+        return None
+
+    backend = None
+    redis_url = os.environ.get('ADMISSION_REDIS_URL')
+    if redis_url:
+        backend = RedisBackend.from_url(redis_url)
+
+    controller = AdmissionController(load_limits(), backend)
+    app.before_request(controller.before_request)
+    app.teardown_request(controller.teardown_request)
+    app.extensions['admission'] = controller
+
+    @app.route('/api/admission-stats')
+    def admission_stats():
+        """Contatori del controllo di ammissione per questo worker"""
+        return jsonify(controller.stats())
+
+    return controller
@@ -6,9 +6,17 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-# Configurazione del logging
-logging.basicConfig(level=logging.DEBUG)
+from logging_config import configure_logging, init_request_id
+from admission import init_admission
+from assets import init_assets
+from fragment_cache import init_fragment_cache
+from profiling import init_profiling
+from utils import permit_expiry_state
+
+# Configurazione del logging (scrittura asincrona, livelli da variabili d'ambiente)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Classe base per i modelli SQLAlchemy
@@ -30,6 +38,28 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "ancora_cas_secret_key")
 
+# Numero di reverse proxy fidati davanti all'app (default 0, esposta direttamente):
+# solo se impostato l'indirizzo del client, usato dal rate limiting, viene letto
+# da X-Forwarded-For; senza proxy l'header sarebbe falsificabile dal client
+proxy_count = int(os.environ.get("PROXY_FIX_X_FOR", "0"))
+if proxy_count > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_count, x_proto=proxy_count)
+
+# Identificativo di richiesta per correlare le righe di log
+init_request_id(app)
+
+# Controllo di ammissione (rate limiting e concorrenza) per API ed export
+init_admission(app)
+
+# Asset statici con impronta del contenuto, precompressi e con cache immutabile
+init_assets(app)
+
+# Cache dei frammenti di template (righe della lista e schede ospite)
+init_fragment_cache(app)
+
+# Profilazione opzionale delle richieste (header X-Profile o campionamento)
+init_profiling(app)
+
 # Inizializzazione di Flask-Migrate per le migrazioni del database
 migrate = Migrate(app, db)
 
@@ -41,9 +71,12 @@ db.init_app(app)
 def inject_now():
     return {'now': datetime.utcnow()}
 
+# Stato di scadenza del permesso, usato anche nelle chiavi della cache dei frammenti
+app.jinja_env.globals['expiry_state'] = permit_expiry_state
+
 # Importazione delle rotte e dei modelli
 with app.app_context():
-    from models import Guest
+    from models import Guest, Room
     from routes import register_routes
 
     # Registrazione delle rotte
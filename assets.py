@@ -0,0 +1,245 @@
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import urllib.request
+
+import click
+from flask import abort, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # La compressione brotli è opzionale
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Librerie di terze parti versionate in static/vendor ("flask assets vendor" le aggiorna)
+VENDOR_ASSETS = {
+    'vendor/bootstrap/bootstrap.min.css':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css',
+    'vendor/bootstrap/bootstrap.bundle.min.js':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js',
+    'vendor/fontawesome/css/all.min.css':
+        'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css',
+}
+for _font in ('fa-solid-900', 'fa-regular-400', 'fa-brands-400', 'fa-v4compatibility'):
+    for _ext in ('woff2', 'ttf'):
+        VENDOR_ASSETS[f'vendor/fontawesome/webfonts/{_font}.{_ext}'] = (
+            f'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/webfonts/{_font}.{_ext}'
+        )
+
+# Cartella (dentro static) con i file generati e relativo manifest
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+# Estensioni per cui vale la pena generare le versioni precompresse
+COMPRESSIBLE = ('.css', '.js', '.svg', '.ttf', '.json', '.map')
+
+mimetypes.add_type('font/woff2', '.woff2')
+
+CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def vendor_assets(static_folder):
+    """
+    Scarica le librerie di terze parti in static/vendor
+
+    Args:
+        static_folder: Percorso della cartella static dell'applicazione
+    """
+    for path, source in VENDOR_ASSETS.items():
+        target = os.path.join(static_folder, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with urllib.request.urlopen(source, timeout=30) as response, open(target, 'wb') as out:
+            shutil.copyfileobj(response, out)
+        logger.info("Scaricato %s", path)
+
+
+def _hashed_name(path, content):
+    """Inserisce l'impronta del contenuto nel nome del file (es. app.1a2b3c4d5e.css)"""
+    digest = hashlib.sha256(content).hexdigest()[:10]
+    root, ext = posixpath.splitext(path)
+    return f'{root}.{digest}{ext}'
+
+
+def _rewrite_css_urls(css_path, content, manifest):
+    """Sostituisce i riferimenti url() relativi con i nomi con impronta"""
+    # I file generati mantengono la struttura delle cartelle: i percorsi relativi restano validi
+    css_dir = posixpath.dirname(css_path)
+
+    def replace(match):
+        quote, ref = match.groups()
+        if ref.startswith(('data:', 'http:', 'https:', '//', '#', '/')):
+            return match.group(0)
+        # Conserva query string e frammento (es. font?v=6.4.0#iefix)
+        split = re.search(r'[?#]', ref)
+        ref_path, suffix = (ref[:split.start()], ref[split.start():]) if split else (ref, '')
+        target = posixpath.normpath(posixpath.join(css_dir, ref_path))
+        if target not in manifest:
+            return match.group(0)
+        new_ref = posixpath.relpath(manifest[target], css_dir) + suffix
+        return f'url({quote}{new_ref}{quote})'
+
+    return CSS_URL_RE.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def _write_atomic(target, content):
+    """Scrive il file tramite un file temporaneo, così più worker possono generarlo insieme"""
+    tmp = f'{target}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as out:
+        out.write(content)
+    os.replace(tmp, target)
+
+
+def _write_compressed(target, content):
+    """Scrive il file e, se utile, le versioni gzip e brotli accanto all'originale"""
+    _write_atomic(target, content)
+    if not target.endswith(COMPRESSIBLE):
+        return
+    _write_atomic(target + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        _write_atomic(target + '.br', brotli.compress(content))
+
+
+def _source_files(static_folder):
+    """Restituisce i percorsi relativi dei file di static, esclusa la cartella dist"""
+    dist_folder = os.path.join(static_folder, DIST_DIR)
+    sources = []
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != dist_folder]
+        for filename in filenames:
+            full_path = os.path.join(dirpath, filename)
+            sources.append(os.path.relpath(full_path, static_folder).replace(os.sep, '/'))
+    return sources
+
+
+def manifest_is_stale(static_folder):
+    """Indica se il manifest manca o se un file di static è più recente del manifest"""
+    manifest_path = os.path.join(static_folder, DIST_DIR, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return True
+    built_at = os.path.getmtime(manifest_path)
+    return any(
+        os.path.getmtime(os.path.join(static_folder, path)) > built_at
+        for path in _source_files(static_folder)
+    )
+
+
+def build_assets(static_folder, clean=True):
+    """
+    Genera in static/dist i file con impronta del contenuto, precompressi
+
+    I CSS vengono elaborati per ultimi, in modo che i riferimenti a font e
+    immagini puntino ai nomi con impronta. Il manifest associa il nome logico
+    (es. "css/custom.css") al nome generato.
+
+    Args:
+        static_folder: Percorso della cartella static dell'applicazione
+        clean: Se True elimina prima i file generati in precedenza
+
+    Returns:
+        Il manifest generato (dizionario)
+    """
+    dist_folder = os.path.join(static_folder, DIST_DIR)
+    if clean and os.path.isdir(dist_folder):
+        shutil.rmtree(dist_folder)
+
+    sources = _source_files(static_folder)
+    sources.sort(key=lambda path: (path.endswith('.css'), path))
+
+    manifest = {}
+    for path in sources:
+        with open(os.path.join(static_folder, path), 'rb') as source:
+            content = source.read()
+        if path.endswith('.css'):
+            content = _rewrite_css_urls(path, content, manifest)
+        manifest[path] = _hashed_name(path, content)
+
+        target = os.path.join(dist_folder, manifest[path])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        _write_compressed(target, content)
+
+    os.makedirs(dist_folder, exist_ok=True)
+    _write_atomic(os.path.join(dist_folder, MANIFEST_NAME),
+                  json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+    return manifest
+
+
+def init_assets(app):
+    """
+    Registra la pipeline degli asset statici sull'applicazione
+
+    - asset_url(): sostituto di url_for che risolve i nomi con impronta
+    - /assets/<file>: file generati, serviti precompressi con cache immutabile
+    - flask assets vendor|build: comandi per aggiornare le librerie e generare gli asset
+
+    Se il manifest manca o è più vecchio dei file di static, gli asset vengono
+    generati all'avvio; "flask assets build" resta disponibile per il deploy.
+    """
+    dist_folder = os.path.join(app.static_folder, DIST_DIR)
+    if manifest_is_stale(app.static_folder):
+        # Senza eliminare dist: i nomi con impronta non cambiano tra i worker
+        try:
+            manifest = build_assets(app.static_folder, clean=False)
+            logger.info("Generati %d asset in static/%s", len(manifest), DIST_DIR)
+        except OSError as e:
+            # Cartella static non scrivibile: si servono i file originali da /static
+            logger.error("Impossibile generare gli asset in static/%s: %s", DIST_DIR, e)
+            manifest = {}
+    else:
+        with open(os.path.join(dist_folder, MANIFEST_NAME)) as source:
+            manifest = json.load(source)
+
+    def asset_url(endpoint, **values):
+        """Come url_for, ma per 'static' restituisce il file con impronta se disponibile"""
+        if endpoint != 'static':
+            return url_for(endpoint, **values)
+        filename = values.pop('filename')
+        if filename in manifest:
+            return url_for('dist_asset', filename=manifest[filename], **values)
+        return url_for('static', filename=filename, **values)
+
+    app.jinja_env.globals['asset_url'] = asset_url
+
+    @app.route('/assets/<path:filename>', endpoint='dist_asset')
+    def dist_asset(filename):
+        """Serve un asset generato, preferendo la versione precompressa accettata dal client"""
+        if filename == MANIFEST_NAME:
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = None
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if encoding in request.accept_encodings and os.path.isfile(os.path.join(dist_folder, filename + suffix)):
+                response = send_from_directory(dist_folder, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = send_from_directory(dist_folder, filename, mimetype=mimetype)
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+    @app.cli.group('assets')
+    def assets_cli():
+        """Gestione degli asset statici"""
+
+    @assets_cli.command('vendor')
+    def vendor_command():
+        """Scarica Bootstrap e Font Awesome in static/vendor (da versionare)"""
+        vendor_assets(app.static_folder)
+        click.echo(f'Scaricati {len(VENDOR_ASSETS)} file in static/vendor')
+
+    @assets_cli.command('build')
+    def build_command():
+        """Genera gli asset con impronta e precompressi in static/dist"""
+        result = build_assets(app.static_folder)
+        click.echo(f'Generati {len(result)} asset in static/{DIST_DIR}')
+        if brotli is None:
+            click.echo('Pacchetto brotli non installato: generate solo le versioni gzip')
@@ -1,7 +1,7 @@
 from datetime import datetime, date
 from flask_wtf import FlaskForm
-from wtforms import StringField, DateField, SelectField, SubmitField
-from wtforms.validators import DataRequired, Length, ValidationError
+from wtforms import StringField, DateField, SelectField, SubmitField, IntegerField, HiddenField, FloatField
+from wtforms.validators import DataRequired, Length, NumberRange, Optional, ValidationError
 
 class GuestForm(FlaskForm):
     """Form per la registrazione e modifica degli ospiti"""
@@ -50,6 +50,9 @@ class GuestForm(FlaskForm):
         Length(min=1, max=10, message="Il numero di stanza deve essere valido")
     ])
     
+    # Versione dell'ospite letta all'apertura del form (concorrenza ottimistica)
+    version_id = HiddenField()
+    
     submit = SubmitField('Salva')
     
     def validate_data_nascita(self, field):
@@ -75,4 +78,65 @@ class GuestForm(FlaskForm):
             # Verifica che la data di rilascio sia successiva alla data di nascita
             if hasattr(self, 'data_nascita') and self.data_nascita.data:
                 if field.data < self.data_nascita.data:
-                    raise ValidationError("La data di rilascio deve essere successiva alla data di nascita")
\ No newline at end of file
+                    raise ValidationError("La data di rilascio deve essere successiva alla data di nascita")
+
+
+class RoomForm(FlaskForm):
+    """Form per la creazione e modifica delle stanze"""
+    numero = StringField('Numero stanza', validators=[
+        DataRequired(message="Il numero della stanza è obbligatorio"),
+        Length(min=1, max=10, message="Il numero di stanza deve essere valido")
+    ])
+    
+    capienza = IntegerField('Posti letto', validators=[
+        DataRequired(message="La capienza è obbligatoria"),
+        NumberRange(min=1, max=50, message="La capienza deve essere compresa tra 1 e 50 posti")
+    ])
+    
+    submit = SubmitField('Salva')
+
+
+class BulkActionForm(FlaskForm):
+    """Form per le azioni multiple sugli ospiti selezionati nella lista"""
+    azione = SelectField('Azione', choices=[
+        ('elimina', 'Elimina selezionati'),
+        ('stanza', 'Sposta in stanza'),
+        ('rinnovo', 'Rinnova permesso')
+    ], validators=[DataRequired(message="Seleziona un'azione")])
+    
+    numero_stanza = StringField('Nuova stanza', validators=[
+        Optional(),
+        Length(min=1, max=10, message="Il numero di stanza deve essere valido")
+    ])
+    
+    data_rilascio_permesso = DateField('Data rilascio rinnovo', validators=[Optional()], format='%Y-%m-%d')
+    
+    submit = SubmitField('Applica')
+    
+    def validate(self, extra_validators=None):
+        """Verifica i campi richiesti dall'azione selezionata"""
+        if not super().validate(extra_validators):
+            return False
+        
+        if self.azione.data == 'stanza' and not (self.numero_stanza.data or '').strip():
+            self.numero_stanza.errors.append("Indicare la stanza di destinazione")
+            return False
+        
+        if self.azione.data == 'rinnovo':
+            if not self.data_rilascio_permesso.data:
+                self.data_rilascio_permesso.errors.append("Indicare la data di rilascio del rinnovo")
+                return False
+            if self.data_rilascio_permesso.data > date.today():
+                self.data_rilascio_permesso.errors.append("La data di rilascio non può essere nel futuro")
+                return False
+        
+        return True
+
+
+class ProfilingForm(FlaskForm):
+    """Form per impostare la frazione di richieste profilate"""
+    sample_rate = FloatField('Frazione di richieste profilate', validators=[
+        NumberRange(min=0, max=1, message="Inserire un valore compreso tra 0 e 1")
+    ])
+    
+    submit = SubmitField('Aggiorna')
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+logger = logging.getLogger(__name__)
+
+# Numero massimo di frammenti conservati in memoria per processo
+DEFAULT_CACHE_SIZE = 5000
+
+# Durata dei frammenti nel backend condiviso (secondi)
+DEFAULT_SHARED_TTL = 24 * 60 * 60
+
+
+class LRUCache:
+    """Cache in memoria con limite sul numero di elementi (least recently used)"""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCache:
+    """Cache condivisa tra i worker tramite Redis (o un sostituto compatibile)"""
+
+    def __init__(self, client, prefix='fragment:', ttl=DEFAULT_SHARED_TTL):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """Crea il backend a partire da un URL Redis (richiede il pacchetto redis)"""
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        try:
+            value = self.client.get(self.prefix + key)
+        except Exception as e:
+            # Un backend non raggiungibile equivale a un frammento non in cache
+            logger.error("Errore nella lettura della cache dei frammenti: %s", e)
+            return None
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value):
+        try:
+            self.client.setex(self.prefix + key, self.ttl, value.encode('utf-8'))
+        except Exception as e:
+            logger.error("Errore nella scrittura della cache dei frammenti: %s", e)
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Estensione Jinja per la cache dei frammenti di template
+
+    Uso: {% cache 'riga', guest.id, guest.updated_at %}...{% endcache %}
+
+    La chiave è composta dal nome del template, dall'impronta del suo sorgente
+    e dai valori indicati: modificando il template dopo un deploy i frammenti
+    generati dalla versione precedente non vengono più usati. Il contenuto
+    viene renderizzato solo se la chiave non è in cache.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=LRUCache())
+
+    def _template_fingerprint(self, name):
+        """Impronta del sorgente del template, calcolata una volta alla compilazione"""
+        loader = self.environment.loader
+        if name is None or loader is None:
+            return ''
+        source, _, _ = loader.get_source(self.environment, name)
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()[:10]
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [nodes.Const(parser.name or ''), nodes.Const(self._template_fingerprint(parser.name))]
+        key_parts.append(parser.parse_expression())
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render_cached', [nodes.List(key_parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_cached(self, key_parts, caller):
+        cache = self.environment.fragment_cache
+        key = ':'.join(str(part) for part in key_parts)
+        value = cache.get(key)
+        if value is None:
+            value = caller()
+            cache.set(key, str(value))
+        return Markup(value)
+
+
+def init_fragment_cache(app):
+    """
+    Registra la cache dei frammenti sull'ambiente Jinja dell'applicazione
+
+    - FRAGMENT_CACHE_SIZE: numero massimo di frammenti in memoria (default 5000)
+    - FRAGMENT_CACHE_REDIS_URL: URL Redis per condividere i frammenti tra i worker
+    - FRAGMENT_CACHE_TTL: durata dei frammenti nel backend condiviso (secondi)
+    - FRAGMENT_CACHE_VERSION: versione inserita nel prefisso delle chiavi Redis,
+      da cambiare per invalidare tutti i frammenti condivisi (es. a ogni deploy)
+    """
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+    redis_url = os.environ.get('FRAGMENT_CACHE_REDIS_URL')
+    if redis_url:
+        ttl = int(os.environ.get('FRAGMENT_CACHE_TTL', DEFAULT_SHARED_TTL))
+        version = os.environ.get('FRAGMENT_CACHE_VERSION', '1')
+        app.jinja_env.fragment_cache = RedisCache.from_url(redis_url, prefix=f'fragment:{version}:', ttl=ttl)
+    else:
+        size = int(os.environ.get('FRAGMENT_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+        app.jinja_env.fragment_cache = LRUCache(size)
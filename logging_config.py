@@ -0,0 +1,157 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+# Da passare come extra ai messaggi sul percorso caldo, che vengono campionati
+HOT_PATH = {'sampled': True}
+
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Aggiunge l'identificativo della richiesta HTTP a ogni record di log"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id', '-')
+        else:
+            record.request_id = '-'
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Lascia passare solo una frazione dei messaggi marcati come HOT_PATH"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, 'sampled', False):
+            return random.random() < self.rate
+        return True
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    QueueHandler che rimanda la formattazione completa al thread di scrittura
+
+    Nel thread della richiesta viene solo risolto il messaggio (%-style) e
+    serializzato l'eventuale traceback, senza applicare il formatter finale.
+    """
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatta i record di log come una riga JSON"""
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def _parse_levels(spec):
+    """
+    Interpreta la configurazione dei livelli per modulo
+
+    Args:
+        spec: Stringa nel formato "modulo=LIVELLO,altro.modulo=LIVELLO"
+
+    Returns:
+        Dizionario {nome logger: livello}
+    """
+    levels = {}
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        name, level = item.split('=', 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    """
+    Configura il logging dell'applicazione a partire dalle variabili d'ambiente
+
+    - LOG_LEVEL: livello del logger radice (default INFO)
+    - LOG_LEVELS: livelli per modulo, es. "utils=WARNING,sqlalchemy.engine=INFO"
+    - LOG_FORMAT: "text" (default) o "json"
+    - LOG_SAMPLE_RATE: frazione dei messaggi HOT_PATH da registrare (default 0.01)
+
+    I record vengono accodati dal thread della richiesta e scritti su stderr
+    da un QueueListener in background.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    if os.environ.get('LOG_FORMAT', 'text').lower() == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s %(levelname)s [%(name)s] [%(request_id)s] %(message)s'
+        )
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = BackgroundQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))))
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+
+    for name, level in _parse_levels(os.environ.get('LOG_LEVELS')).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def init_request_id(app):
+    """Assegna un identificativo a ogni richiesta e lo restituisce nell'header X-Request-ID"""
+
+    @app.before_request
+    def assign_request_id():
+        request_id = request.headers.get('X-Request-ID', '')
+        # Accetta l'identificativo del proxy solo se breve e privo di caratteri speciali
+        if not request_id or len(request_id) > 64 or not request_id.isascii() or not request_id.replace('-', '').isalnum():
+            request_id = uuid.uuid4().hex
+        g.request_id = request_id
+
+    @app.after_request
+    def add_request_id_header(response):
+        response.headers['X-Request-ID'] = g.get('request_id', '')
+        return response
@@ -0,0 +1,94 @@
+"""Add rooms table and guests.room_id foreign key
+
+Revision ID: 3c7d1e9a4b20
+Revises: 915621bc8a5f
+Create Date: 2026-10-18 09:12:31.418206
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c7d1e9a4b20'
+down_revision = '915621bc8a5f'
+branch_labels = None
+depends_on = None
+
+# Capienza assegnata alle stanze ricavate dai dati esistenti (da verificare manualmente)
+DEFAULT_ROOM_CAPACITY = 4
+
+
+def _room_sort_key(numero):
+    # Copia di utils.room_sort_key, congelata per questa migrazione
+    return re.sub(r'\d+', lambda m: m.group().zfill(10), numero.strip().upper())
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+
+    # db.create_all() all'avvio dell'app può aver già creato la tabella rooms
+    if not inspector.has_table('rooms'):
+        op.create_table(
+            'rooms',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('numero', sa.String(length=10), nullable=False),
+            sa.Column('capienza', sa.Integer(), nullable=False),
+            sa.Column('sort_key', sa.String(length=128), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('numero')
+        )
+        with op.batch_alter_table('rooms', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_rooms_sort_key'), ['sort_key'], unique=False)
+
+    if 'room_id' not in {column['name'] for column in inspector.get_columns('guests')}:
+        with op.batch_alter_table('guests', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('room_id', sa.Integer(), nullable=True))
+            batch_op.create_index(batch_op.f('ix_guests_room_id'), ['room_id'], unique=False)
+            batch_op.create_foreign_key('fk_guests_room_id_rooms', 'rooms', ['room_id'], ['id'])
+
+    # Popola le stanze a partire dai numeri di stanza già presenti (se non ancora create)
+    esistenti = {row[0] for row in conn.execute(sa.text("SELECT numero FROM rooms"))}
+    numeri = sorted({
+        row[0].strip().upper()
+        for row in conn.execute(sa.text("SELECT DISTINCT numero_stanza FROM guests"))
+        if row[0] and row[0].strip()
+    } - esistenti)
+    if numeri:
+        rooms = sa.table(
+            'rooms',
+            sa.column('numero', sa.String),
+            sa.column('capienza', sa.Integer),
+            sa.column('sort_key', sa.String),
+        )
+        op.bulk_insert(rooms, [
+            {
+                'numero': numero,
+                'capienza': DEFAULT_ROOM_CAPACITY,
+                'sort_key': _room_sort_key(numero),
+            }
+            for numero in numeri
+        ])
+
+    # Collega gli ospiti alle stanze e normalizza il numero di stanza
+    op.execute(
+        "UPDATE guests SET room_id = "
+        "(SELECT rooms.id FROM rooms WHERE rooms.numero = UPPER(TRIM(guests.numero_stanza)))"
+    )
+    op.execute("UPDATE guests SET numero_stanza = UPPER(TRIM(numero_stanza))")
+
+
+def downgrade():
+    with op.batch_alter_table('guests', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_guests_room_id_rooms', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_guests_room_id'))
+        batch_op.drop_column('room_id')
+
+    with op.batch_alter_table('rooms', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_rooms_sort_key'))
+
+    op.drop_table('rooms')
@@ -0,0 +1,32 @@
+"""Add version_id to guests for optimistic concurrency
+
+Revision ID: 8f2b6c0d5e71
+Revises: 3c7d1e9a4b20
+Create Date: 2026-10-18 14:03:52.771940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f2b6c0d5e71'
+down_revision = '3c7d1e9a4b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('guests', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version_id', sa.Integer(), nullable=True))
+
+    # Tutte le righe esistenti partono dalla versione 1
+    op.execute("UPDATE guests SET version_id = 1 WHERE version_id IS NULL")
+
+    with op.batch_alter_table('guests', schema=None) as batch_op:
+        batch_op.alter_column('version_id', existing_type=sa.Integer(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('guests', schema=None) as batch_op:
+        batch_op.drop_column('version_id')
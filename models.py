@@ -1,5 +1,101 @@
 from datetime import datetime
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import validates
 from app import db
+from utils import room_sort_key
+
+# Capienza assegnata alle stanze create automaticamente al check-in
+DEFAULT_ROOM_CAPACITY = 4
+
+
+class Room(db.Model):
+    """Modello per le stanze del centro"""
+    __tablename__ = 'rooms'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    numero = db.Column(db.String(10), nullable=False, unique=True)
+    capienza = db.Column(db.Integer, nullable=False, default=DEFAULT_ROOM_CAPACITY)
+    # Chiave di ordinamento naturale ("2" prima di "10"), indicizzata
+    sort_key = db.Column(db.String(128), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<Room {self.numero} ({self.capienza} posti)>"
+    
+    @validates('numero')
+    def _validate_numero(self, key, numero):
+        """Normalizza il numero e aggiorna la chiave di ordinamento"""
+        numero = numero.strip().upper()
+        self.sort_key = room_sort_key(numero)
+        return numero
+    
+    def occupanti(self, exclude_guest_id=None):
+        """Conta gli ospiti assegnati alla stanza (lookup sull'indice guests.room_id)"""
+        query = Guest.query.filter(Guest.room_id == self.id)
+        if exclude_guest_id is not None:
+            query = query.filter(Guest.id != exclude_guest_id)
+        return query.count()
+    
+    def posti_liberi(self, exclude_guest_id=None):
+        """Restituisce il numero di posti letto liberi nella stanza"""
+        return self.capienza - self.occupanti(exclude_guest_id)
+    
+    @classmethod
+    def get_or_create(cls, numero):
+        """
+        Recupera la stanza dal numero (indice univoco) o la crea con la capienza predefinita
+        
+        La riga della stanza viene bloccata (SELECT ... FOR UPDATE) fino al commit:
+        il conteggio degli occupanti e l'assegnazione successivi non possono
+        intrecciarsi con quelli di un'altra richiesta sulla stessa stanza.
+        """
+        numero = numero.strip().upper()
+        room = cls.query.filter_by(numero=numero).with_for_update().first()
+        if room is None:
+            try:
+                with db.session.begin_nested():
+                    room = cls(numero=numero, capienza=DEFAULT_ROOM_CAPACITY)
+                    db.session.add(room)
+            except IntegrityError:
+                # Stanza creata nel frattempo da un'altra richiesta
+                room = cls.query.filter_by(numero=numero).with_for_update().one()
+        return room
+    
+    @classmethod
+    def occupancy_query(cls):
+        """
+        Query aggregata per l'occupazione delle stanze
+    
+        Restituisce, in un'unica query raggruppata, righe (Room, occupati, posti_liberi)
+        ordinate per numero di stanza in ordine naturale.
+        """
+        occupati = func.count(Guest.id)
+        return (db.session.query(
+                    cls,
+                    occupati.label('occupati'),
+                    (cls.capienza - occupati).label('posti_liberi'))
+                .outerjoin(Guest, Guest.room_id == cls.id)
+                .group_by(cls.id)
+                .order_by(cls.sort_key))
+    
+    @classmethod
+    def first_with_free_beds(cls):
+        """
+        Restituisce la prima stanza (in ordine naturale) con almeno un posto libero
+        
+        Scorre le stanze sull'indice sort_key e si ferma alla prima libera; gli
+        occupanti sono contati con una sottoquery correlata sull'indice guests.room_id.
+        """
+        occupati = (select(func.count(Guest.id))
+                    .where(Guest.room_id == cls.id)
+                    .correlate(cls)
+                    .scalar_subquery())
+        return (cls.query
+                .filter(cls.capienza > occupati)
+                .order_by(cls.sort_key)
+                .first())
+
 
 class Guest(db.Model):
     """Modello per gli ospiti del centro"""
@@ -16,9 +112,16 @@ class Guest(db.Model):
     data_rilascio_permesso = db.Column(db.Date, nullable=False)
     data_scadenza_permesso = db.Column(db.Date, nullable=False)
     numero_stanza = db.Column(db.String(10), nullable=False)
+    room_id = db.Column(db.Integer, db.ForeignKey('rooms.id'), nullable=True, index=True)
     codice_fiscale = db.Column(db.String(16), nullable=False, unique=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Versione della riga: ogni UPDATE è condizionato alla versione letta
+    version_id = db.Column(db.Integer, nullable=False, default=1)
+    
+    __mapper_args__ = {'version_id_col': version_id}
+    
+    room = db.relationship('Room', backref=db.backref('guests', lazy='dynamic'))
     
     def __repr__(self):
         return f"<Guest {self.nome} {self.cognome} - {self.codice_fiscale}>"
@@ -36,7 +139,9 @@ class Guest(db.Model):
             'data_rilascio_permesso': self.data_rilascio_permesso.strftime('%d/%m/%Y') if self.data_rilascio_permesso else None,
             'data_scadenza_permesso': self.data_scadenza_permesso.strftime('%d/%m/%Y') if self.data_scadenza_permesso else None,
             'numero_stanza': self.numero_stanza,
+            'room_id': self.room_id,
             'codice_fiscale': self.codice_fiscale,
+            'version_id': self.version_id,
             'created_at': self.created_at.strftime('%d/%m/%Y %H:%M') if self.created_at else None,
             'updated_at': self.updated_at.strftime('%d/%m/%Y %H:%M') if self.updated_at else None
         }
\ No newline at end of file
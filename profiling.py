@@ -0,0 +1,313 @@
+import glob
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import abort, flash, g, has_request_context, redirect, render_template, request, send_from_directory, session, url_for
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from forms import ProfilingForm
+
+logger = logging.getLogger(__name__)
+
+# Intervallo di campionamento degli stack (secondi)
+SAMPLE_INTERVAL = 0.005
+
+# Numero di profili mostrati nella pagina di amministrazione
+RECENT_PROFILES = 50
+
+# Numero di profili conservati su disco (i più vecchi vengono eliminati)
+DEFAULT_MAX_PROFILES = 200
+
+# Rotte mai profilate (file statici e pagine di amministrazione dei profili)
+EXCLUDED_ENDPOINTS = {'static', 'dist_asset', 'profile_list', 'profile_download'}
+
+# tracemalloc è globale: resta attivo finché c'è almeno una richiesta profilata.
+# Il picco non viene azzerato a ogni richiesta, per non falsare quello delle
+# richieste profilate in parallelo: è il picco del processo durante il tracciamento.
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+
+
+def _start_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    """Restituisce il picco di memoria del processo e ferma tracemalloc se non più necessario"""
+    global _tracing_users
+    with _tracing_lock:
+        _, peak = tracemalloc.get_traced_memory()
+        _tracing_users -= 1
+        if _tracing_users == 0:
+            tracemalloc.stop()
+        return peak
+
+
+class StackSampler:
+    """
+    Profiler a campionamento per un singolo thread
+
+    Un thread in background legge periodicamente lo stack del thread della
+    richiesta e conta gli stack nel formato "folded" (func;func;func N),
+    compatibile con flamegraph.pl e speedscope.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name}@{os.path.basename(code.co_filename)}:{code.co_firstlineno}')
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self):
+        """Restituisce gli stack campionati nel formato folded"""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.counts.most_common())
+
+
+@contextmanager
+def memory_snapshot(label):
+    """
+    Registra le allocazioni del blocco con tracemalloc, se la richiesta è profilata
+
+    Il confronto tra gli snapshot prima e dopo il blocco viene salvato insieme
+    al profilo della richiesta. Fuori da una richiesta profilata non fa nulla.
+    """
+    profile = g.get('profile')
+    if profile is None or not tracemalloc.is_tracing():
+        yield
+        return
+
+    before = tracemalloc.take_snapshot()
+    try:
+        yield
+    finally:
+        after = tracemalloc.take_snapshot()
+        stats = after.compare_to(before, 'lineno')[:25]
+        profile['memory_reports'][label] = '\n'.join(str(stat) for stat in stats)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    """Conta le query SQL eseguite durante una richiesta profilata"""
+    profile = g.get('profile') if has_request_context() else None
+    if profile is not None:
+        profile['queries'] += 1
+
+
+class Profiler:
+    """Profilazione opzionale delle richieste in produzione"""
+
+    def __init__(self, output_dir, sample_rate=0.0, token=None, max_profiles=DEFAULT_MAX_PROFILES):
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.token = token
+        self.max_profiles = max_profiles
+
+    def _should_profile(self):
+        if request.endpoint in EXCLUDED_ENDPOINTS:
+            return False
+        header = request.headers.get('X-Profile')
+        # L'header è accettato solo con PROFILING_TOKEN impostato e deve contenere il token
+        if header and self.token and hmac.compare_digest(header.encode(), self.token.encode()):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _admin_marker(self):
+        """Valore salvato in sessione dopo l'accesso, legato al token corrente"""
+        return hmac.new(self.token.encode(), b'profiling-admin', hashlib.sha256).hexdigest()
+
+    def require_admin(self):
+        """
+        Protegge le pagine dei profili con PROFILING_TOKEN
+
+        Senza token configurato le pagine non esistono (404). Il token si
+        indica una volta con ?token=... (o nell'header X-Profile) e resta
+        valido per la sessione finché non viene cambiato.
+
+        Returns:
+            Un redirect se il token è stato appena indicato nell'URL, altrimenti None
+        """
+        if not self.token:
+            abort(404)
+        given = request.args.get('token') or request.headers.get('X-Profile')
+        if given:
+            if not hmac.compare_digest(given.encode(), self.token.encode()):
+                abort(403)
+            session['profiling_admin'] = self._admin_marker()
+            if 'token' in request.args:
+                # Toglie il token dall'URL (cronologia e log di accesso)
+                return redirect(request.path)
+            return None
+        if not hmac.compare_digest(session.get('profiling_admin', ''), self._admin_marker()):
+            abort(403)
+        return None
+
+    def before_request(self):
+        if not self._should_profile():
+            return
+
+        _start_tracing()
+        sampler = StackSampler(threading.get_ident())
+        g.profile = {
+            'sampler': sampler,
+            'start': time.perf_counter(),
+            'queries': 0,
+            'status': None,
+            'memory_reports': {},
+        }
+        sampler.start()
+
+    def after_request(self, response):
+        profile = g.get('profile')
+        if profile is not None:
+            profile['status'] = response.status_code
+        return response
+
+    def teardown_request(self, exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+
+        duration = time.perf_counter() - profile['start']
+        profile['sampler'].stop()
+        peak = _stop_tracing()
+
+        try:
+            self._write(profile, duration, peak)
+        except Exception as e:
+            logger.error("Errore nel salvataggio del profilo: %s", e)
+
+    def _write(self, profile, duration, peak):
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{g.get('request_id') or os.urandom(4).hex()}"
+
+        with open(os.path.join(self.output_dir, name + '.folded'), 'w') as out:
+            out.write(profile['sampler'].folded())
+
+        for label, report in profile['memory_reports'].items():
+            with open(os.path.join(self.output_dir, f'{name}.{label}.memory.txt'), 'w') as out:
+                out.write(report)
+
+        metadata = {
+            'name': name,
+            'created_at': datetime.utcnow().strftime('%d/%m/%Y %H:%M:%S'),
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': profile['status'],
+            'duration_ms': round(duration * 1000, 1),
+            'queries': profile['queries'],
+            'process_peak_memory_kb': round(peak / 1024, 1),
+            'samples': sum(profile['sampler'].counts.values()),
+            'memory_reports': sorted(profile['memory_reports']),
+        }
+        with open(os.path.join(self.output_dir, name + '.json'), 'w') as out:
+            json.dump(metadata, out, indent=2)
+
+        logger.info("Profilo salvato: %s (%s, %.1f ms)", name, request.endpoint, metadata['duration_ms'])
+        self._prune()
+
+    def _prune(self):
+        """Elimina i profili più vecchi oltre il numero massimo conservato"""
+        paths = sorted(glob.glob(os.path.join(self.output_dir, '*.json')), reverse=True)
+        for path in paths[self.max_profiles:]:
+            name = os.path.basename(path)[:-len('.json')]
+            for old in glob.glob(os.path.join(glob.escape(self.output_dir), glob.escape(name) + '.*')):
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    # Già eliminato da un'altra richiesta
+                    pass
+
+    def recent(self, limit=RECENT_PROFILES):
+        """Restituisce i metadati dei profili più recenti"""
+        paths = sorted(glob.glob(os.path.join(self.output_dir, '*.json')), reverse=True)[:limit]
+        profiles = []
+        for path in paths:
+            with open(path) as source:
+                profiles.append(json.load(source))
+        return profiles
+
+
+def init_profiling(app):
+    """
+    Registra la profilazione opzionale delle richieste
+
+    - PROFILING_DIR: cartella dei profili (default instance/profiles)
+    - PROFILING_SAMPLE_RATE: frazione di richieste profilate (default 0)
+    - PROFILING_TOKEN: valore dell'header X-Profile che forza la profilazione
+      e richiesto per /admin/profiles (senza token header e pagine sono disattivati)
+    - PROFILING_MAX_FILES: numero di profili conservati su disco (default 200)
+
+    La frazione campionata si può modificare a runtime da /admin/profiles;
+    la modifica vale solo per il processo che riceve la richiesta.
+    """
+    profiler = Profiler(
+        os.environ.get('PROFILING_DIR', os.path.join(app.instance_path, 'profiles')),
+        float(os.environ.get('PROFILING_SAMPLE_RATE', '0')),
+        os.environ.get('PROFILING_TOKEN') or None,
+        int(os.environ.get('PROFILING_MAX_FILES', DEFAULT_MAX_PROFILES)),
+    )
+    app.before_request(profiler.before_request)
+    app.after_request(profiler.after_request)
+    app.teardown_request(profiler.teardown_request)
+    app.extensions['profiler'] = profiler
+
+    if not event.contains(Engine, 'before_cursor_execute', _count_query):
+        event.listen(Engine, 'before_cursor_execute', _count_query)
+
+    @app.route('/admin/profiles', methods=['GET', 'POST'])
+    def profile_list():
+        """Elenco dei profili recenti e impostazione del campionamento"""
+        login = profiler.require_admin()
+        if login is not None:
+            return login
+        form = ProfilingForm(sample_rate=profiler.sample_rate)
+        if form.validate_on_submit():
+            profiler.sample_rate = form.sample_rate.data
+            flash(f'Campionamento impostato al {profiler.sample_rate:.1%} delle richieste (solo questo processo).', 'success')
+            return redirect(url_for('profile_list'))
+        return render_template('profiles.html', form=form, profiles=profiler.recent(), pid=os.getpid())
+
+    @app.route('/admin/profiles/<path:filename>')
+    def profile_download(filename):
+        """Scarica un file di profilo (stack folded o report di memoria)"""
+        profiler.require_admin()
+        if not filename.endswith(('.folded', '.memory.txt')):
+            abort(404)
+        return send_from_directory(profiler.output_dir, filename, as_attachment=True)
+
+    return profiler
@@ -3,16 +3,72 @@ import logging
 import xlsxwriter
 from datetime import datetime
 from flask import render_template, redirect, url_for, request, flash, send_file, jsonify
-from sqlalchemy import or_
+from sqlalchemy import or_, update, delete
+from sqlalchemy.orm.exc import StaleDataError
 
 from app import db
-from models import Guest
-from forms import GuestForm
+from models import Guest, Room
+from forms import GuestForm, RoomForm, BulkActionForm
 from utils import generate_codice_fiscale, calculate_expiry_date
+from profiling import memory_snapshot
 
 # Configurazione del logger
 logger = logging.getLogger(__name__)
 
+# Messaggio mostrato quando un altro operatore ha salvato l'ospite nel frattempo
+CONFLICT_MESSAGE = ('Questo ospite è stato modificato da un altro operatore mentre lo stavi modificando. '
+                    'Sono stati caricati i dati aggiornati: verifica e ripeti le modifiche.')
+
+def guest_values_from_form(form):
+    """
+    Estrae dal form i valori dei campi dell'ospite, normalizzati come vengono salvati
+    
+    Args:
+        form: GuestForm validato
+        
+    Returns:
+        Dizionario {nome campo: valore}
+    """
+    return {
+        'nome': form.nome.data,
+        'cognome': form.cognome.data,
+        'data_nascita': form.data_nascita.data,
+        'sesso': form.sesso.data,
+        'paese_nascita': form.paese_nascita.data,
+        'provincia_nascita': form.provincia_nascita.data or None,
+        'numero_permesso': form.numero_permesso.data,
+        'data_rilascio_permesso': form.data_rilascio_permesso.data,
+        'numero_stanza': form.numero_stanza.data.strip().upper(),
+    }
+
+def assign_room(guest, numero_stanza):
+    """
+    Assegna la stanza all'ospite verificando la disponibilità di posti letto
+    
+    Args:
+        guest: Ospite da assegnare
+        numero_stanza: Numero della stanza richiesta
+        
+    Returns:
+        Messaggio di errore se la stanza è al completo, altrimenti None
+    """
+    # Le query di controllo non devono scrivere in anticipo le modifiche dell'ospite
+    with db.session.no_autoflush:
+        room = Room.get_or_create(numero_stanza)
+        
+        # Se l'ospite è già nella stanza non serve alcun controllo
+        if guest.room_id == room.id:
+            guest.numero_stanza = room.numero
+            return None
+        
+        # Conteggio degli occupanti tramite l'indice su guests.room_id
+        if room.posti_liberi(exclude_guest_id=guest.id) <= 0:
+            return f'La stanza {room.numero} è al completo ({room.capienza} posti letto)'
+    
+    guest.room = room
+    guest.numero_stanza = room.numero
+    return None
+
 def register_routes(app):
     """Registra tutte le rotte dell'applicazione"""
     
@@ -54,7 +110,7 @@ def register_routes(app):
             return jsonify({'codice_fiscale': codice_fiscale})
             
         except Exception as e:
-            logger.error(f"Errore nel calcolo del codice fiscale: {str(e)}")
+            logger.error("Errore nel calcolo del codice fiscale: %s", e)
             return jsonify({'error': str(e)}), 500
     
     # API per il calcolo della data di scadenza
@@ -86,7 +142,7 @@ def register_routes(app):
             return jsonify({'data_scadenza': data_scadenza_str})
             
         except Exception as e:
-            logger.error(f"Errore nel calcolo della data di scadenza: {str(e)}")
+            logger.error("Errore nel calcolo della data di scadenza: %s", e)
             return jsonify({'error': str(e)}), 500
     
     @app.route('/')
@@ -125,7 +181,10 @@ def register_routes(app):
         # Ordinamento
         sort_by = request.args.get('sort', 'cognome')
         if sort_by == 'numero_stanza':
-            guests = query.order_by(Guest.numero_stanza).all()
+            # Ordinamento naturale tramite la chiave indicizzata della stanza
+            guests = query.outerjoin(Guest.room).order_by(
+                Room.sort_key, Guest.cognome, Guest.nome
+            ).all()
         elif sort_by == 'data_scadenza':
             guests = query.order_by(Guest.data_scadenza_permesso).all()
         else:
@@ -134,7 +193,8 @@ def register_routes(app):
         return render_template('guest_list.html', 
                              guests=guests, 
                              search_term=search_term,
-                             sort_by=sort_by)
+                             sort_by=sort_by,
+                             bulk_form=BulkActionForm())
     
     @app.route('/guests/export')
     def export_guests():
@@ -156,45 +216,47 @@ def register_routes(app):
         
         guests = query.order_by(Guest.cognome, Guest.nome).all()
         
-        # Crea un output in memoria per il file Excel
-        output = io.BytesIO()
-        workbook = xlsxwriter.Workbook(output)
-        worksheet = workbook.add_worksheet('Ospiti')
-        
-        # Formati
-        header_format = workbook.add_format({'bold': True, 'bg_color': '#2980b9', 'color': 'white', 'border': 1})
-        date_format = workbook.add_format({'num_format': 'dd/mm/yyyy'})
-        cell_format = workbook.add_format({'border': 1})
-        
-        # Intestazioni
-        headers = [
-            'ID', 'Cognome', 'Nome', 'Data di Nascita', 'Sesso',
-            'Paese di Nascita', 'Codice Fiscale', 'Numero Permesso',
-            'Data Rilascio', 'Data Scadenza', 'Numero Stanza'
-        ]
-        
-        for col, header in enumerate(headers):
-            worksheet.write(0, col, header, header_format)
-        
-        # Dati
-        for row, guest in enumerate(guests, start=1):
-            worksheet.write(row, 0, guest.id, cell_format)
-            worksheet.write(row, 1, guest.cognome, cell_format)
-            worksheet.write(row, 2, guest.nome, cell_format)
-            worksheet.write(row, 3, guest.data_nascita, date_format)
-            worksheet.write(row, 4, 'Maschio' if guest.sesso == 'M' else 'Femmina', cell_format)
-            worksheet.write(row, 5, guest.paese_nascita, cell_format)
-            worksheet.write(row, 6, guest.codice_fiscale, cell_format)
-            worksheet.write(row, 7, guest.numero_permesso, cell_format)
-            worksheet.write(row, 8, guest.data_rilascio_permesso, date_format)
-            worksheet.write(row, 9, guest.data_scadenza_permesso, date_format)
-            worksheet.write(row, 10, guest.numero_stanza, cell_format)
-        
-        # Adatta la larghezza delle colonne
-        for i, col in enumerate(headers):
-            worksheet.set_column(i, i, len(col) + 5)
-        
-        workbook.close()
+        # Generazione del file (allocazioni registrate se la richiesta è profilata)
+        with memory_snapshot('export'):
+            # Crea un output in memoria per il file Excel
+            output = io.BytesIO()
+            workbook = xlsxwriter.Workbook(output)
+            worksheet = workbook.add_worksheet('Ospiti')
+            
+            # Formati
+            header_format = workbook.add_format({'bold': True, 'bg_color': '#2980b9', 'color': 'white', 'border': 1})
+            date_format = workbook.add_format({'num_format': 'dd/mm/yyyy'})
+            cell_format = workbook.add_format({'border': 1})
+            
+            # Intestazioni
+            headers = [
+                'ID', 'Cognome', 'Nome', 'Data di Nascita', 'Sesso',
+                'Paese di Nascita', 'Codice Fiscale', 'Numero Permesso',
+                'Data Rilascio', 'Data Scadenza', 'Numero Stanza'
+            ]
+            
+            for col, header in enumerate(headers):
+                worksheet.write(0, col, header, header_format)
+            
+            # Dati
+            for row, guest in enumerate(guests, start=1):
+                worksheet.write(row, 0, guest.id, cell_format)
+                worksheet.write(row, 1, guest.cognome, cell_format)
+                worksheet.write(row, 2, guest.nome, cell_format)
+                worksheet.write(row, 3, guest.data_nascita, date_format)
+                worksheet.write(row, 4, 'Maschio' if guest.sesso == 'M' else 'Femmina', cell_format)
+                worksheet.write(row, 5, guest.paese_nascita, cell_format)
+                worksheet.write(row, 6, guest.codice_fiscale, cell_format)
+                worksheet.write(row, 7, guest.numero_permesso, cell_format)
+                worksheet.write(row, 8, guest.data_rilascio_permesso, date_format)
+                worksheet.write(row, 9, guest.data_scadenza_permesso, date_format)
+                worksheet.write(row, 10, guest.numero_stanza, cell_format)
+            
+            # Adatta la larghezza delle colonne
+            for i, col in enumerate(headers):
+                worksheet.set_column(i, i, len(col) + 5)
+            
+            workbook.close()
         
         # Posiziona il puntatore all'inizio del file
         output.seek(0)
@@ -214,6 +276,12 @@ def register_routes(app):
         """Crea un nuovo ospite"""
         form = GuestForm()
         
+        # Suggerisci la prima stanza con posti letto liberi
+        if request.method == 'GET' and not form.numero_stanza.data:
+            free_room = Room.first_with_free_beds()
+            if free_room:
+                form.numero_stanza.data = free_room.numero
+        
         # Gestisci la generazione automatica del codice fiscale e data scadenza
         if form.nome.data and form.cognome.data and form.data_nascita.data and form.paese_nascita.data and form.sesso.data:
             # Genera il codice fiscale
@@ -276,6 +344,13 @@ def register_routes(app):
                     flash(f'Un ospite con questo codice fiscale già esiste: {codice_fiscale}', 'danger')
                     return render_template('guest_form.html', form=form, title='Nuovo Ospite')
                 
+                # Assegna la stanza verificando i posti letto liberi
+                room_error = assign_room(guest, form.numero_stanza.data)
+                if room_error:
+                    db.session.rollback()
+                    flash(room_error, 'danger')
+                    return render_template('guest_form.html', form=form, title='Nuovo Ospite')
+                
                 db.session.add(guest)
                 db.session.commit()
                 
@@ -284,7 +359,7 @@ def register_routes(app):
                 
             except Exception as e:
                 db.session.rollback()
-                logger.error(f"Error creating guest: {str(e)}")
+                logger.error("Error creating guest: %s", e)
                 flash(f'Errore: {str(e)}', 'danger')
         
         return render_template('guest_form.html', form=form, title='Nuovo Ospite')
@@ -331,39 +406,65 @@ def register_routes(app):
         
         # Validazione del form e salvataggio
         if form.validate_on_submit():
+            # Controllo di concorrenza ottimistica: l'ospite è cambiato dopo l'apertura del form?
+            if form.version_id.data and str(form.version_id.data) != str(guest.version_id):
+                flash(CONFLICT_MESSAGE, 'warning')
+                return redirect(url_for('edit_guest', id=guest.id))
+            
             try:
-                # Aggiorna i dati dell'ospite dal form
-                form.populate_obj(guest)
+                # Calcola i nuovi valori, inclusi quelli derivati
+                values = guest_values_from_form(form)
+                values['data_scadenza_permesso'] = calculate_expiry_date(values['data_rilascio_permesso'])
+                values['codice_fiscale'] = generate_codice_fiscale(
+                    values['nome'],
+                    values['cognome'],
+                    values['data_nascita'],
+                    values['paese_nascita'],
+                    values['sesso'],
+                    values['provincia_nascita']
+                ) or guest.codice_fiscale
                 
-                # Ricalcola la data di scadenza
-                guest.data_scadenza_permesso = calculate_expiry_date(guest.data_rilascio_permesso)
-                
-                # Rigenera il codice fiscale
-                new_codice_fiscale = generate_codice_fiscale(
-                    guest.nome,
-                    guest.cognome,
-                    guest.data_nascita,
-                    guest.paese_nascita,
-                    guest.sesso
-                )
+                # Nessuna differenza rispetto ai dati salvati: nessun UPDATE
+                changes = {
+                    field: value for field, value in values.items()
+                    if getattr(guest, field) != value
+                }
+                if not changes:
+                    flash('Nessuna modifica da salvare.', 'info')
+                    return redirect(url_for('guest_list'))
                 
                 # Verifica se il codice fiscale è cambiato e se il nuovo è già in uso
-                if new_codice_fiscale != guest.codice_fiscale:
-                    existing = Guest.query.filter_by(codice_fiscale=new_codice_fiscale).first()
+                if 'codice_fiscale' in changes:
+                    existing = Guest.query.filter_by(codice_fiscale=changes['codice_fiscale']).first()
                     if existing and existing.id != guest.id:
-                        flash(f'Un altro ospite con questo codice fiscale già esiste: {new_codice_fiscale}', 'danger')
+                        flash(f'Un altro ospite con questo codice fiscale già esiste: {changes["codice_fiscale"]}', 'danger')
                         return render_template('guest_form.html', form=form, guest=guest, title='Modifica Ospite')
-                    
-                    # Aggiorna con il nuovo codice fiscale
-                    guest.codice_fiscale = new_codice_fiscale
                 
+                # Aggiorna solo i campi modificati
+                for field, value in changes.items():
+                    setattr(guest, field, value)
+                
+                # Riassegna la stanza verificando i posti letto liberi
+                if 'numero_stanza' in changes:
+                    room_error = assign_room(guest, guest.numero_stanza)
+                    if room_error:
+                        db.session.rollback()
+                        flash(room_error, 'danger')
+                        return render_template('guest_form.html', form=form, guest=guest, title='Modifica Ospite')
+                
+                # L'UPDATE include la condizione sulla versione letta (version_id_col)
                 db.session.commit()
                 flash('Dati ospite aggiornati con successo!', 'success')
                 return redirect(url_for('guest_list'))
                 
+            except StaleDataError:
+                db.session.rollback()
+                flash(CONFLICT_MESSAGE, 'warning')
+                return redirect(url_for('edit_guest', id=guest.id))
+                
             except Exception as e:
                 db.session.rollback()
-                logger.error(f"Error updating guest: {str(e)}")
+                logger.error("Error updating guest: %s", e)
                 flash(f'Errore: {str(e)}', 'danger')
         
         return render_template('guest_form.html', form=form, guest=guest, title='Modifica Ospite')
@@ -379,11 +480,167 @@ def register_routes(app):
             flash('Ospite eliminato con successo!', 'success')
         except Exception as e:
             db.session.rollback()
-            logger.error(f"Error deleting guest: {str(e)}")
+            logger.error("Error deleting guest: %s", e)
             flash(f'Errore durante l\'eliminazione: {str(e)}', 'danger')
             
         return redirect(url_for('guest_list'))
     
+    @app.route('/guests/bulk', methods=['POST'])
+    def bulk_guests():
+        """Applica un'azione a più ospiti con un'unica istruzione UPDATE/DELETE"""
+        form = BulkActionForm()
+        back = redirect(url_for('guest_list',
+                                search=request.form.get('search', ''),
+                                sort=request.form.get('sort', 'cognome')))
+        
+        guest_ids = sorted({int(value) for value in request.form.getlist('guest_ids') if value.isdigit()})
+        if not guest_ids:
+            flash('Nessun ospite selezionato.', 'warning')
+            return back
+        
+        if not form.validate_on_submit():
+            for errors in form.errors.values():
+                for error in errors:
+                    flash(error, 'danger')
+            return back
+        
+        selected = Guest.id.in_(guest_ids)
+        avviso = None
+        
+        try:
+            if form.azione.data == 'elimina':
+                result = db.session.execute(
+                    delete(Guest).where(selected).execution_options(synchronize_session=False)
+                )
+                message = f'{result.rowcount} ospiti eliminati.'
+            
+            elif form.azione.data == 'stanza':
+                # Riga della stanza bloccata fino al commit: conteggio e UPDATE non si intrecciano
+                room = Room.get_or_create(form.numero_stanza.data)
+                
+                # Posti liberi contando solo gli ospiti che non fanno parte dello spostamento
+                occupanti = Guest.query.filter(Guest.room_id == room.id, ~selected).count()
+                # Ospiti selezionati ancora esistenti (gli ID della pagina possono essere superati)
+                da_spostare = Guest.query.filter(selected).count()
+                if occupanti + da_spostare > room.capienza:
+                    db.session.rollback()
+                    flash(f'La stanza {room.numero} ha {max(room.capienza - occupanti, 0)} posti liberi: '
+                          f'impossibile spostare {da_spostare} ospiti.', 'danger')
+                    return back
+                
+                result = db.session.execute(
+                    update(Guest).where(selected).values(
+                        room_id=room.id,
+                        numero_stanza=room.numero,
+                        version_id=Guest.version_id + 1
+                    ).execution_options(synchronize_session=False)
+                )
+                message = f'{result.rowcount} ospiti spostati nella stanza {room.numero}.'
+            
+            else:
+                data_rilascio = form.data_rilascio_permesso.data
+                data_scadenza = calculate_expiry_date(data_rilascio)
+                # Stessa regola di GuestForm: il permesso non può essere rilasciato prima della nascita
+                result = db.session.execute(
+                    update(Guest).where(selected, Guest.data_nascita <= data_rilascio).values(
+                        data_rilascio_permesso=data_rilascio,
+                        data_scadenza_permesso=data_scadenza,
+                        version_id=Guest.version_id + 1
+                    ).execution_options(synchronize_session=False)
+                )
+                message = (f'{result.rowcount} permessi rinnovati '
+                           f'(nuova scadenza {data_scadenza.strftime("%d/%m/%Y")}).')
+                
+                if result.rowcount < len(guest_ids):
+                    esclusi = (Guest.query
+                               .filter(selected, Guest.data_nascita > data_rilascio)
+                               .order_by(Guest.cognome, Guest.nome)
+                               .all())
+                    if esclusi:
+                        avviso = (f'{len(esclusi)} ospiti non aggiornati, data di rilascio precedente '
+                                  f'alla data di nascita: {", ".join(f"{g.cognome} {g.nome}" for g in esclusi)}.')
+            
+            db.session.commit()
+            flash(message, 'success')
+            if avviso:
+                flash(avviso, 'warning')
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error in bulk action %s: %s", form.azione.data, e)
+            flash(f'Errore durante l\'operazione: {str(e)}', 'danger')
+        
+        return back
+    
+    @app.route('/rooms')
+    def room_list():
+        """Occupazione delle stanze calcolata con un'unica query raggruppata"""
+        rows = Room.occupancy_query().all()
+        
+        totals = {
+            'capienza': sum(room.capienza for room, _, _ in rows),
+            'occupati': sum(occupati for _, occupati, _ in rows),
+            'posti_liberi': sum(max(liberi, 0) for _, _, liberi in rows),
+            'sovraffollate': sum(1 for _, _, liberi in rows if liberi < 0)
+        }
+        
+        return render_template('rooms.html', rows=rows, totals=totals)
+    
+    @app.route('/rooms/new', methods=['GET', 'POST'])
+    def create_room():
+        """Crea una nuova stanza"""
+        form = RoomForm()
+        
+        if form.validate_on_submit():
+            numero = form.numero.data.strip().upper()
+            if Room.query.filter_by(numero=numero).first():
+                flash(f'La stanza {numero} esiste già', 'danger')
+                return render_template('room_form.html', form=form, title='Nuova Stanza')
+            
+            try:
+                room = Room(numero=numero, capienza=form.capienza.data)
+                db.session.add(room)
+                db.session.commit()
+                flash('Stanza aggiunta con successo!', 'success')
+                return redirect(url_for('room_list'))
+            except Exception as e:
+                db.session.rollback()
+                logger.error("Error creating room: %s", e)
+                flash(f'Errore: {str(e)}', 'danger')
+        
+        return render_template('room_form.html', form=form, title='Nuova Stanza')
+    
+    @app.route('/rooms/<int:id>/edit', methods=['GET', 'POST'])
+    def edit_room(id):
+        """Modifica la capienza di una stanza"""
+        room = Room.query.get_or_404(id)
+        form = RoomForm(obj=room)
+        
+        if form.validate_on_submit():
+            numero = form.numero.data.strip().upper()
+            existing = Room.query.filter_by(numero=numero).first()
+            if existing and existing.id != room.id:
+                flash(f'La stanza {numero} esiste già', 'danger')
+                return render_template('room_form.html', form=form, room=room, title='Modifica Stanza')
+            
+            try:
+                form.populate_obj(room)
+                
+                # Mantieni allineato il numero di stanza degli ospiti assegnati
+                Guest.query.filter(Guest.room_id == room.id).update(
+                    {Guest.numero_stanza: room.numero, Guest.version_id: Guest.version_id + 1},
+                    synchronize_session=False
+                )
+                
+                db.session.commit()
+                flash('Stanza aggiornata con successo!', 'success')
+                return redirect(url_for('room_list'))
+            except Exception as e:
+                db.session.rollback()
+                logger.error("Error updating room: %s", e)
+                flash(f'Errore: {str(e)}', 'danger')
+        
+        return render_template('room_form.html', form=form, room=room, title='Modifica Stanza')
+    
     # Gestione degli errori
     @app.errorhandler(404)
     def not_found_error(error):
@@ -0,0 +1,68 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admission import DEFAULT_LIMITS, MemoryBackend, RedisBackend, load_limits
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def backend(request):
+    if request.param == 'memory':
+        return MemoryBackend()
+    fakeredis = pytest.importorskip('fakeredis')
+    # Lo script Lua richiede fakeredis con il supporto a lupa
+    pytest.importorskip('lupa')
+    return RedisBackend(fakeredis.FakeRedis())
+
+
+def test_bucket_esaurito_dopo_il_burst(backend):
+    # Tasso bassissimo: il bucket non si ricarica durante il test
+    for _ in range(3):
+        assert backend.consume('api:127.0.0.1', 0.001, 3) == 0
+    retry_after = backend.consume('api:127.0.0.1', 0.001, 3)
+    assert retry_after > 0
+
+    # Un altro client ha il proprio bucket
+    assert backend.consume('api:10.0.0.2', 0.001, 3) == 0
+
+
+def test_redis_backend_condiviso_tra_istanze():
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    server = fakeredis.FakeServer()
+    first = RedisBackend(fakeredis.FakeRedis(server=server))
+    second = RedisBackend(fakeredis.FakeRedis(server=server))
+
+    assert first.consume('export', 0.001, 1) == 0
+    assert second.consume('export', 0.001, 1) > 0
+
+
+def test_load_limits_da_json():
+    limits = load_limits(json.dumps({
+        'export_guests': {'concurrency': 1},
+        'api_calcola_scadenza': None,
+    }))
+    assert limits['export_guests']['concurrency'] == 1
+    assert limits['export_guests']['route_rate'] == DEFAULT_LIMITS['export_guests']['route_rate']
+    assert 'api_calcola_scadenza' not in limits
+    assert DEFAULT_LIMITS['export_guests']['concurrency'] == 2
+
+
+def test_memory_backend_elimina_i_bucket_pieni():
+    backend = MemoryBackend(max_buckets=2)
+    # Tasso alto: i bucket tornano pieni quasi subito
+    backend.consume('a', 1000, 1)
+    backend.consume('b', 1000, 1)
+    time.sleep(0.01)
+    backend.consume('c', 1000, 1)
+    assert set(backend._buckets) == {'c'}
+
+    # Un bucket non ancora ricaricato viene conservato
+    backend.consume('lento', 0.001, 1)
+    backend.consume('d', 1000, 1)
+    assert 'lento' in backend._buckets
@@ -1,7 +1,10 @@
 import logging
+import re
 from datetime import date, timedelta, datetime
 import codicefiscale
 
+from logging_config import HOT_PATH
+
 logger = logging.getLogger(__name__)
 
 def generate_codice_fiscale(nome, cognome, data_nascita, paese_nascita, sesso='M', provincia_nascita=None):
@@ -20,8 +23,6 @@ def generate_codice_fiscale(nome, cognome, data_nascita, paese_nascita, sesso='M
         Il codice fiscale generato o None se la generazione fallisce
     """
     try:
-        logger.info(f"Generating codice fiscale for: {nome} {cognome}, born in {paese_nascita}, province: {provincia_nascita}")
-        
         # Tentativo di generare il codice fiscale con la libreria codicefiscale
         # Per cittadini stranieri, usare un codice specifico per paese estero
         if paese_nascita.lower() not in ['italia', 'italy']:
@@ -52,11 +53,12 @@ def generate_codice_fiscale(nome, cognome, data_nascita, paese_nascita, sesso='M
             municipality=belfiore_code
         )
         
-        logger.info(f"Generated codice fiscale: {codice}")
+        # Percorso caldo (calcolo in tempo reale): messaggio campionato e privo di dati personali
+        logger.debug("Codice fiscale generato", extra=HOT_PATH)
         return codice
     
     except Exception as e:
-        logger.error(f"Error generating codice fiscale: {str(e)}")
+        logger.error("Error generating codice fiscale: %s", e)
         return None
 
 
@@ -79,5 +81,44 @@ def calculate_expiry_date(issue_date):
         )
         return expiry_date
     except Exception as e:
-        logger.error(f"Error calculating expiry date: {str(e)}")
-        return None
\ No newline at end of file
+        logger.error("Error calculating expiry date: %s", e)
+        return None
+
+
+def permit_expiry_state(data_scadenza, oggi=None):
+    """
+    Classifica lo stato di scadenza del permesso di soggiorno
+    
+    Args:
+        data_scadenza: Data di scadenza del permesso
+        oggi: Data di riferimento (default: data odierna UTC)
+        
+    Returns:
+        'scaduto', 'in_scadenza' (entro 30 giorni), 'valido' oppure None se la data manca
+    """
+    if not data_scadenza:
+        return None
+    oggi = oggi or datetime.utcnow().date()
+    if data_scadenza <= oggi:
+        return 'scaduto'
+    if (data_scadenza - oggi).days <= 30:
+        return 'in_scadenza'
+    return 'valido'
+
+
+def room_sort_key(numero_stanza):
+    """
+    Calcola la chiave di ordinamento naturale per un numero di stanza
+    
+    Le sequenze di cifre vengono allineate a 10 caratteri, in modo che
+    l'ordinamento lessicografico della chiave corrisponda a quello naturale
+    ("2" prima di "10", "2B" prima di "10A").
+    
+    Args:
+        numero_stanza: Numero della stanza (testo libero)
+        
+    Returns:
+        Chiave di ordinamento (stringa)
+    """
+    numero = (numero_stanza or '').strip().upper()
+    return re.sub(r'\d+', lambda m: m.group().zfill(10), numero)